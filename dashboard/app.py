@@ -3,19 +3,31 @@ Solaris Media — Fraud Detection Dashboard
 Run: streamlit run dashboard/app.py
 """
 
-import json
 import os
 import io
+import sys
 
 import duckdb
+import numpy as np
+import orjson
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from plotly.subplots import make_subplots
 import streamlit as st
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.schema import parquet_select
+
 # ── Config ────────────────────────────────────────────────────────────────────
 
+# st.plotly_chart serialises figures with plotly.io.to_json on every rerun
+pio.json.config.default_engine = "orjson"
+
 st.set_page_config(
     page_title="Solaris Fraud Detection",
     page_icon="🛡️",
@@ -29,52 +41,172 @@ RISK_COLORS = {
     "HIGH": "#F44336",
     "CRITICAL": "#9C27B0",
 }
+RISK_BADGES = {
+    "LOW": "🟢 LOW",
+    "MEDIUM": "🟠 MEDIUM",
+    "HIGH": "🔴 HIGH",
+    "CRITICAL": "🟣 CRITICAL",
+}
+RISK_LEVEL_DTYPE = pd.CategoricalDtype(list(RISK_COLORS), ordered=True)
+CATEGORICAL_COLUMNS = ("country", "subscription_tier", "status", "dow", "currency", "bin_country")
+# Bound on the per-filter caches (panels, figures): each filter combination is a new key
+CACHE_MAX_ENTRIES = 32
+CACHE_TTL = "1h"
 
 DATA_PATH = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
     "data",
     "enriched_transactions.csv",
 )
+PARQUET_PATH = os.path.splitext(DATA_PATH)[0] + ".parquet"
+
+# Known high-fraud IP ranges (same list as pipeline/risk_scoring.py)
+FOREIGN_PREFIXES = ("5.188.", "185.220.", "193.32.", "45.142.", "91.108.")
+DECLINE_STATUSES = frozenset({"declined_fraud", "declined_insufficient_funds"})
+FRAUD_STATUSES = frozenset({"declined_fraud", "chargeback"})
+# SQL-derived helper columns used by the panels; kept out of the user CSV export
+INTERNAL_COLUMNS = [
+    "signals_list", "geo_mismatch", "is_decline", "is_fraud_outcome", "is_chargeback", "is_critical",
+]
+
 
 # ── Data loader ───────────────────────────────────────────────────────────────
 
+def sync_parquet(conn) -> None:
+    """
+    Convert the enriched CSV to a sibling Parquet file so loads skip CSV parsing.
+    Re-converts only when the Parquet copy is missing or older than the CSV, with
+    the same column types the pipeline writes (pipeline.schema).
+    """
+    if (
+        not os.path.exists(PARQUET_PATH)
+        or os.path.getmtime(PARQUET_PATH) < os.path.getmtime(DATA_PATH)
+    ):
+        conn.execute(f"""
+            COPY ({parquet_select(f"read_csv_auto('{DATA_PATH}')")})
+            TO '{PARQUET_PATH}' (FORMAT PARQUET, COMPRESSION ZSTD)
+        """)
+
+
 @st.cache_resource
 def get_duckdb_conn():
     """Persistent DuckDB in-memory connection, shared across Streamlit reruns."""
     conn = duckdb.connect()
+    conn.execute("LOAD json")
+    sync_parquet(conn)
     conn.execute(f"""
         CREATE OR REPLACE VIEW transactions AS
-        SELECT * FROM read_csv_auto('{DATA_PATH}')
+        SELECT * FROM read_parquet('{PARQUET_PATH}')
     """)
     return conn
 
 
-@st.cache_data
-def load_data() -> pd.DataFrame:
-    """Load enriched transactions via DuckDB and add derived columns."""
+@st.cache_data(max_entries=1)
+def load_data(data_mtime: float) -> pd.DataFrame:
+    """
+    Load enriched transactions via DuckDB; derived columns are computed in SQL.
+    Keyed on the CSV's mtime so the cache only invalidates when the data changes;
+    only the current version is kept.
+    """
     conn = get_duckdb_conn()
-    df = conn.execute("""
-        SELECT *
+    sync_parquet(conn)
+    foreign_ip = " OR ".join(f"starts_with(ip_address, '{p}')" for p in FOREIGN_PREFIXES)
+    df = conn.execute(f"""
+        SELECT
+            *,
+            CAST(timestamp AS DATE)                                          AS date,
+            hour(timestamp)                                                  AS hour,
+            dayname(timestamp)                                               AS dow,
+            COALESCE(from_json(signals_triggered, '["VARCHAR"]'), [])        AS signals_list,
+            COALESCE(json_array_length(signals_triggered), 0)                AS signal_count,
+            ({foreign_ip}) OR bin_country <> country                        AS geo_mismatch,
+            status = ANY($decline_statuses)                                  AS is_decline,
+            status = ANY($fraud_statuses)                                    AS is_fraud_outcome,
+            status = 'chargeback'                                            AS is_chargeback,
+            risk_level = 'CRITICAL'                                          AS is_critical
         FROM transactions
         ORDER BY timestamp
-    """).df()
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df["date"] = df["timestamp"].dt.date
-    df["hour"] = df["timestamp"].dt.hour
-    df["dow"] = df["timestamp"].dt.day_name()
-    df["signals_list"] = df["signals_triggered"].apply(
-        lambda x: json.loads(x) if pd.notna(x) else []
-    )
-    df["signal_count"] = df["signals_list"].apply(len)
+    """, {
+        "decline_statuses": sorted(DECLINE_STATUSES),
+        "fraud_statuses": sorted(FRAUD_STATUSES),
+    }).df(date_as_object=True)
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype("category")
+    df["risk_level"] = df["risk_level"].astype(RISK_LEVEL_DTYPE)
     return df
 
 
-def query(sql: str, df: pd.DataFrame = None) -> pd.DataFrame:
-    """Run an analytical SQL query via DuckDB. Optionally register a DataFrame as 'df'."""
-    conn = duckdb.connect()
-    if df is not None:
-        conn.register("df", df)
-    return conn.execute(sql).df()
+def run_queries(df: pd.DataFrame, queries: dict) -> dict:
+    """
+    Run several analytical SQL queries against one DuckDB copy of `df`.
+    The frame is registered on a private cursor of the shared connection and copied
+    into a temp table named 'base' once, so each query scans DuckDB's columnar
+    storage instead of re-importing the pandas frame. Returns {name: DataFrame}.
+    """
+    cursor = get_duckdb_conn().cursor()
+    try:
+        cursor.register("df", df)
+        cursor.execute("CREATE TEMP TABLE base AS SELECT * FROM df")
+        return {name: cursor.execute(sql).df() for name, sql in queries.items()}
+    finally:
+        cursor.close()
+
+
+# Aggregates behind the time-series, BIN and IP panels (see compute_panels)
+PANEL_COLUMNS = ["timestamp", "risk_level", "risk_score", "status", "card_bin", "card_last4", "ip_address"]
+PANEL_QUERIES = {
+    "daily_risk": """
+        SELECT
+            CAST(timestamp AS DATE)          AS date,
+            risk_level,
+            COUNT(*)                         AS volume
+        FROM base
+        GROUP BY CAST(timestamp AS DATE), risk_level
+        ORDER BY date, risk_level
+    """,
+    "daily_score": """
+        SELECT
+            CAST(timestamp AS DATE)          AS date,
+            ROUND(AVG(risk_score), 2)        AS avg_risk
+        FROM base
+        GROUP BY CAST(timestamp AS DATE)
+        ORDER BY date
+    """,
+    "bin_stats": """
+        SELECT
+            card_bin,
+            COUNT(*)                                                                         AS total,
+            ROUND(AVG(risk_score), 1)                                                        AS avg_risk,
+            SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
+                     THEN 1 ELSE 0 END)                                                      AS declines,
+            SUM(CASE WHEN status = 'chargeback' THEN 1 ELSE 0 END)                          AS chargebacks,
+            ROUND(CAST(SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
+                              THEN 1 ELSE 0 END) AS DOUBLE) / COUNT(*) * 100, 1)            AS decline_rate
+        FROM base
+        GROUP BY card_bin
+        ORDER BY avg_risk DESC
+    """,
+    "ip_stats": """
+        SELECT
+            ip_address,
+            COUNT(*)                                                                          AS total_txns,
+            COUNT(DISTINCT card_last4)                                                        AS unique_cards,
+            COUNT(DISTINCT card_bin)                                                          AS unique_bins,
+            ROUND(AVG(risk_score), 1)                                                         AS avg_risk,
+            SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
+                     THEN 1 ELSE 0 END)                                                       AS declines
+        FROM base
+        GROUP BY ip_address
+        ORDER BY unique_cards DESC
+        LIMIT 15
+    """,
+}
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def compute_panels(df: pd.DataFrame) -> dict:
+    """Run every PANEL_QUERIES aggregate over the filtered frame in one DuckDB session."""
+    return run_queries(df, PANEL_QUERIES)
 
 
 def check_data_exists() -> bool:
@@ -83,6 +215,35 @@ def check_data_exists() -> bool:
 
 # ── Sidebar ───────────────────────────────────────────────────────────────────
 
+def apply_filters(
+    df: pd.DataFrame,
+    date_range: tuple,
+    countries: list,
+    tiers: list,
+    risks: list,
+    statuses: list,
+) -> pd.DataFrame:
+    """
+    Combine all sidebar filters into one boolean mask and index once.
+    An empty selection leaves that dimension unfiltered. Not cached: copying a
+    cached slice back out costs about as much as recomputing the mask.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if len(date_range) == 2:
+        start_d, end_d = date_range
+        ts = df["timestamp"].to_numpy()
+        mask &= (ts >= np.datetime64(start_d)) & (ts < np.datetime64(end_d) + np.timedelta64(1, "D"))
+    if countries:
+        mask &= df["country"].isin(countries).to_numpy()
+    if tiers:
+        mask &= df["subscription_tier"].isin(tiers).to_numpy()
+    if risks:
+        mask &= df["risk_level"].isin(risks).to_numpy()
+    if statuses:
+        mask &= df["status"].isin(statuses).to_numpy()
+    return df[mask]
+
+
 def render_sidebar(df: pd.DataFrame) -> pd.DataFrame:
     st.sidebar.image(
         "https://img.shields.io/badge/Solaris%20Media-Fraud%20Detection-purple",
@@ -111,30 +272,32 @@ def render_sidebar(df: pd.DataFrame) -> pd.DataFrame:
     statuses = sorted(df["status"].unique())
     selected_statuses = st.sidebar.multiselect("Status", statuses, default=statuses)
 
-    # Apply filters
-    filtered = df.copy()
-    if len(date_range) == 2:
-        start_d, end_d = date_range
-        filtered = filtered[
-            (filtered["timestamp"].dt.date >= start_d)
-            & (filtered["timestamp"].dt.date <= end_d)
-        ]
-    if selected_countries:
-        filtered = filtered[filtered["country"].isin(selected_countries)]
-    if selected_tiers:
-        filtered = filtered[filtered["subscription_tier"].isin(selected_tiers)]
-    if selected_risks:
-        filtered = filtered[filtered["risk_level"].isin(selected_risks)]
-    if selected_statuses:
-        filtered = filtered[filtered["status"].isin(selected_statuses)]
+    filtered = apply_filters(
+        df,
+        tuple(date_range),
+        selected_countries,
+        selected_tiers,
+        selected_risks,
+        selected_statuses,
+    )
 
     # Export button
     st.sidebar.markdown("---")
-    csv_buffer = io.StringIO()
-    filtered.drop(columns=["signals_list"], errors="ignore").to_csv(csv_buffer, index=False)
+    # Arrow's C++ CSV writer encodes straight to bytes (no intermediate str); unlike
+    # to_csv it quotes every string field and writes whole floats without ".0"
+    csv_buffer = io.BytesIO()
+    export_table = pa.Table.from_pandas(
+        filtered.drop(columns=INTERNAL_COLUMNS, errors="ignore"), preserve_index=False
+    )
+    # Whole seconds, so timestamps keep the "YYYY-MM-DD HH:MM:SS" shape of the source CSV
+    ts_idx = export_table.schema.get_field_index("timestamp")
+    export_table = export_table.set_column(
+        ts_idx, "timestamp", export_table.column(ts_idx).cast(pa.timestamp("s"), safe=False)
+    )
+    pacsv.write_csv(export_table, csv_buffer)
     st.sidebar.download_button(
         "⬇️ Export Filtered CSV",
-        data=csv_buffer.getvalue().encode("utf-8"),
+        data=csv_buffer.getvalue(),
         file_name="filtered_transactions.csv",
         mime="text/csv",
         use_container_width=True,
@@ -148,11 +311,10 @@ def render_sidebar(df: pd.DataFrame) -> pd.DataFrame:
 
 def render_kpis(df: pd.DataFrame) -> None:
     total = len(df)
-    fraud_txns = df[df["status"].isin(["declined_fraud", "chargeback"])]
-    fraud_rate = len(fraud_txns) / total * 100 if total else 0
-    chargebacks = len(df[df["status"] == "chargeback"])
+    fraud_rate = df["is_fraud_outcome"].mean() * 100 if total else 0
+    chargebacks = int(df["is_chargeback"].sum())
     avg_risk = df["risk_score"].mean() if total else 0
-    critical_count = len(df[df["risk_level"] == "CRITICAL"])
+    critical_count = int(df["is_critical"].sum())
 
     cols = st.columns(5)
     cols[0].metric("Total Transactions", f"{total:,}")
@@ -169,29 +331,8 @@ def render_kpis(df: pd.DataFrame) -> None:
 
 # ── Time Series ───────────────────────────────────────────────────────────────
 
-def render_time_series(df: pd.DataFrame) -> None:
-    st.subheader("📈 Transaction Volume & Fraud Score Over Time")
-
-    # DuckDB: volume per day × risk level + avg score per day
-    daily_risk = query("""
-        SELECT
-            CAST(timestamp AS DATE)          AS date,
-            risk_level,
-            COUNT(*)                         AS volume
-        FROM df
-        GROUP BY CAST(timestamp AS DATE), risk_level
-        ORDER BY date, risk_level
-    """, df)
-
-    daily_score = query("""
-        SELECT
-            CAST(timestamp AS DATE)          AS date,
-            ROUND(AVG(risk_score), 2)        AS avg_risk
-        FROM df
-        GROUP BY CAST(timestamp AS DATE)
-        ORDER BY date
-    """, df)
-
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_time_series_fig(daily_risk: pd.DataFrame, daily_score: pd.DataFrame) -> go.Figure:
     # Stacked bars: one bar per day, split by risk level, colored by risk
     risk_order = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
     fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -210,9 +351,9 @@ def render_time_series(df: pd.DataFrame) -> None:
             secondary_y=False,
         )
 
-    # Avg risk score line on secondary axis
+    # Avg risk score line on secondary axis (WebGL: no per-point SVG nodes)
     fig.add_trace(
-        go.Scatter(
+        go.Scattergl(
             x=daily_score["date"],
             y=daily_score["avg_risk"],
             name="Avg Risk Score",
@@ -227,25 +368,27 @@ def render_time_series(df: pd.DataFrame) -> None:
         barmode="stack",
         height=380,
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        hovermode="closest",
+        uirevision="time_series",
+        transition={"duration": 0},
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
     )
     fig.update_yaxes(title_text="Transaction Volume (by Risk Level)", secondary_y=False)
     fig.update_yaxes(title_text="Avg Risk Score", secondary_y=True, showgrid=False)
+    return fig
+
 
+def render_time_series(panels: dict) -> None:
+    st.subheader("📈 Transaction Volume & Fraud Score Over Time")
+    fig = _build_time_series_fig(panels["daily_risk"], panels["daily_score"])
     st.plotly_chart(fig, use_container_width=True)
 
 
 # ── Risk Distribution ─────────────────────────────────────────────────────────
 
-def render_risk_distribution(df: pd.DataFrame) -> None:
-    st.subheader("🎯 Risk Distribution")
-    col1, col2 = st.columns(2)
-
-    # Donut chart
-    level_counts = df["risk_level"].value_counts().reindex(
-        ["LOW", "MEDIUM", "HIGH", "CRITICAL"], fill_value=0
-    )
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_donut_fig(level_counts: pd.Series) -> go.Figure:
     fig_donut = go.Figure(
         go.Pie(
             labels=level_counts.index,
@@ -258,17 +401,15 @@ def render_risk_distribution(df: pd.DataFrame) -> None:
         title="Risk Level Breakdown",
         height=320,
         showlegend=True,
+        transition={"duration": 0},
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
     )
-    col1.plotly_chart(fig_donut, use_container_width=True)
+    return fig_donut
 
-    # Stacked bar by country
-    country_risk = (
-        df.groupby(["country", "risk_level"])
-        .size()
-        .reset_index(name="count")
-    )
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_country_risk_fig(country_risk: pd.DataFrame) -> go.Figure:
     fig_bar = px.bar(
         country_risk,
         x="country",
@@ -280,10 +421,33 @@ def render_risk_distribution(df: pd.DataFrame) -> None:
         height=320,
     )
     fig_bar.update_layout(
+        transition={"duration": 0},
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
     )
-    col2.plotly_chart(fig_bar, use_container_width=True)
+    return fig_bar
+
+
+def render_risk_distribution(df: pd.DataFrame) -> None:
+    st.subheader("🎯 Risk Distribution")
+    col1, col2 = st.columns(2)
+
+    # Donut chart
+    # risk_level is an ordered categorical, so its codes bincount straight into LOW..CRITICAL
+    levels = df["risk_level"].cat
+    level_counts = pd.Series(
+        np.bincount(levels.codes, minlength=len(levels.categories)),
+        index=levels.categories,
+    )
+    col1.plotly_chart(_build_donut_fig(level_counts), use_container_width=True)
+
+    # Stacked bar by country
+    country_risk = (
+        df.groupby(["country", "risk_level"], observed=True)
+        .size()
+        .reset_index(name="count")
+    )
+    col2.plotly_chart(_build_country_risk_fig(country_risk), use_container_width=True)
 
 
 # ── Top Anomalies Table ───────────────────────────────────────────────────────
@@ -291,46 +455,46 @@ def render_risk_distribution(df: pd.DataFrame) -> None:
 def render_anomalies_table(df: pd.DataFrame) -> None:
     st.subheader("🚨 Top 20 Anomalies by Risk Score")
 
-    top20 = (
-        df.nlargest(20, "risk_score")[
-            [
-                "timestamp", "customer_email", "amount", "currency",
-                "country", "risk_level", "risk_score", "signals_triggered", "status",
-            ]
+    top20 = df.nlargest(20, "risk_score")[
+        [
+            "timestamp", "customer_email", "amount", "currency",
+            "country", "risk_level", "risk_score", "signals_triggered", "status",
         ]
-        .copy()
-    )
-    top20["timestamp"] = top20["timestamp"].dt.strftime("%Y-%m-%d %H:%M")
-    top20["signals_triggered"] = top20["signals_triggered"].apply(
-        lambda x: ", ".join(json.loads(x)) if pd.notna(x) else ""
+    ]
+    top20 = top20.assign(
+        timestamp=top20["timestamp"].dt.strftime("%Y-%m-%d %H:%M"),
+        # signals_list is already parsed by load_data(); no per-row json.loads needed
+        signals_triggered=df.loc[top20.index, "signals_list"].str.join(", "),
+        risk_level=top20["risk_level"].map(RISK_BADGES),
     )
 
-    def highlight_critical(row):
-        if row["risk_level"] == "CRITICAL":
-            return ["background-color: #4a0030; color: white"] * len(row)
-        elif row["risk_level"] == "HIGH":
-            return ["background-color: #4a1000; color: white"] * len(row)
-        return [""] * len(row)
-
-    styled = top20.style.apply(highlight_critical, axis=1).format(
-        {"amount": "{:.2f}", "risk_score": "{:.0f}"}
+    # Plain frame + column_config goes over Arrow; a pandas Styler would be
+    # rendered to per-cell CSS first
+    st.dataframe(
+        top20,
+        column_config={
+            "amount": st.column_config.NumberColumn(format="%.2f"),
+            "risk_score": st.column_config.NumberColumn(format="%d"),
+            "risk_level": st.column_config.TextColumn(help="🟣 CRITICAL ≥ 66 · 🔴 HIGH 41–65"),
+        },
+        use_container_width=True,
+        height=500,
     )
-    st.dataframe(styled, use_container_width=True, height=500)
 
 
 # ── Pattern Insights Tabs ─────────────────────────────────────────────────────
 
-def render_pattern_insights(df: pd.DataFrame) -> None:
+def render_pattern_insights(df: pd.DataFrame, panels: dict) -> None:
     st.subheader("🔬 Pattern Insights")
     tab_bins, tab_ips, tab_horario, tab_geo = st.tabs(
         ["💳 BINs", "🌐 IPs", "🕐 Horario", "🗺️ Geo"]
     )
 
     with tab_bins:
-        _render_bins_tab(df)
+        _render_bins_tab(panels["bin_stats"])
 
     with tab_ips:
-        _render_ips_tab(df)
+        _render_ips_tab(panels["ip_stats"])
 
     with tab_horario:
         _render_hourly_tab(df)
@@ -339,23 +503,8 @@ def render_pattern_insights(df: pd.DataFrame) -> None:
         _render_geo_tab(df)
 
 
-def _render_bins_tab(df: pd.DataFrame) -> None:
-    bin_stats = query("""
-        SELECT
-            card_bin,
-            COUNT(*)                                                                         AS total,
-            ROUND(AVG(risk_score), 1)                                                        AS avg_risk,
-            SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
-                     THEN 1 ELSE 0 END)                                                      AS declines,
-            SUM(CASE WHEN status = 'chargeback' THEN 1 ELSE 0 END)                          AS chargebacks,
-            ROUND(CAST(SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
-                              THEN 1 ELSE 0 END) AS DOUBLE) / COUNT(*) * 100, 1)            AS decline_rate
-        FROM df
-        GROUP BY card_bin
-        ORDER BY avg_risk DESC
-    """, df)
-    top_bins = bin_stats.head(10)
-
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_bins_fig(top_bins: pd.DataFrame) -> go.Figure:
     fig = px.bar(
         top_bins,
         x="card_bin",
@@ -366,8 +515,18 @@ def _render_bins_tab(df: pd.DataFrame) -> None:
         labels={"avg_risk": "Avg Risk Score", "card_bin": "BIN", "decline_rate": "Decline %"},
         height=350,
     )
-    fig.update_layout(plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)")
-    st.plotly_chart(fig, use_container_width=True)
+    fig.update_layout(
+        hovermode="closest",
+        uirevision="bins",
+        transition={"duration": 0},
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+    )
+    return fig
+
+
+def _render_bins_tab(bin_stats: pd.DataFrame) -> None:
+    st.plotly_chart(_build_bins_fig(bin_stats.head(10)), use_container_width=True)
 
     st.markdown("**BIN Detail Table**")
     display_cols = bin_stats.nlargest(15, "avg_risk")[
@@ -377,25 +536,10 @@ def _render_bins_tab(df: pd.DataFrame) -> None:
     st.dataframe(display_cols.reset_index(drop=True), use_container_width=True)
 
 
-def _render_ips_tab(df: pd.DataFrame) -> None:
-    ip_stats = query("""
-        SELECT
-            ip_address,
-            COUNT(*)                                                                          AS total_txns,
-            COUNT(DISTINCT card_last4)                                                        AS unique_cards,
-            COUNT(DISTINCT card_bin)                                                          AS unique_bins,
-            ROUND(AVG(risk_score), 1)                                                         AS avg_risk,
-            SUM(CASE WHEN status IN ('declined_fraud','declined_insufficient_funds')
-                     THEN 1 ELSE 0 END)                                                       AS declines
-        FROM df
-        GROUP BY ip_address
-        ORDER BY unique_cards DESC
-        LIMIT 15
-    """, df)
-    top_ips = ip_stats
-
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_ips_fig(top_ips: pd.DataFrame) -> go.Figure:
     fig = px.bar(
-        top_ips.head(10),
+        top_ips,
         x="ip_address",
         y="unique_cards",
         color="avg_risk",
@@ -406,10 +550,18 @@ def _render_ips_tab(df: pd.DataFrame) -> None:
     )
     fig.update_layout(
         xaxis_tickangle=-45,
+        hovermode="closest",
+        uirevision="ips",
+        transition={"duration": 0},
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
     )
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+
+def _render_ips_tab(ip_stats: pd.DataFrame) -> None:
+    top_ips = ip_stats
+    st.plotly_chart(_build_ips_fig(top_ips.head(10)), use_container_width=True)
 
     st.markdown("**Suspicious IPs (>3 unique cards)**")
     suspicious = top_ips[top_ips["unique_cards"] > 3][
@@ -419,56 +571,73 @@ def _render_ips_tab(df: pd.DataFrame) -> None:
     st.dataframe(suspicious.reset_index(drop=True), use_container_width=True)
 
 
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_heatmap_fig(pivot: pd.DataFrame, color_scale: str, title: str, color_label: str) -> go.Figure:
+    fig = px.imshow(
+        pivot,
+        color_continuous_scale=color_scale,
+        aspect="auto",
+        title=title,
+        labels={"x": "Hour of Day", "y": "Day of Week", "color": color_label},
+        height=380,
+    )
+    fig.update_layout(
+        transition={"duration": 0},
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+    )
+    return fig
+
+
 def _render_hourly_tab(df: pd.DataFrame) -> None:
     dow_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    heatmap_data = (
-        df.groupby(["dow", "hour"])
+    # One dow × hour grid holding both metrics; each heatmap takes a column slice
+    grid = (
+        df.groupby(["dow", "hour"], observed=True)
         .agg(avg_risk=("risk_score", "mean"), count=("transaction_id", "count"))
-        .reset_index()
+        .unstack("hour")
     )
+    grid = grid.reindex([d for d in dow_order if d in grid.index])
+    pivot = grid["avg_risk"]
 
-    pivot = heatmap_data.pivot(index="dow", columns="hour", values="avg_risk").reindex(
-        [d for d in dow_order if d in heatmap_data["dow"].unique()]
+    fig = _build_heatmap_fig(
+        pivot, "RdYlGn_r", "Fraud Risk Heatmap: Hour of Day × Day of Week", "Avg Risk Score"
     )
-
-    fig = px.imshow(
-        pivot,
-        color_continuous_scale="RdYlGn_r",
-        aspect="auto",
-        title="Fraud Risk Heatmap: Hour of Day × Day of Week",
-        labels={"x": "Hour of Day", "y": "Day of Week", "color": "Avg Risk Score"},
-        height=380,
-    )
-    fig.update_layout(plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)")
     st.plotly_chart(fig, use_container_width=True)
 
     # Volume heatmap
-    pivot_vol = heatmap_data.pivot(index="dow", columns="hour", values="count").reindex(
-        [d for d in dow_order if d in heatmap_data["dow"].unique()]
+    pivot_vol = grid["count"]
+    fig2 = _build_heatmap_fig(pivot_vol, "Blues", "Transaction Volume Heatmap", "Count")
+    st.plotly_chart(fig2, use_container_width=True)
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def _build_geo_country_fig(country_counts: pd.DataFrame) -> go.Figure:
+    fig = px.bar(
+        country_counts,
+        x="country",
+        y="count",
+        color="count",
+        color_continuous_scale="Reds",
+        title="Geo Mismatch Count by Transaction Country",
+        height=320,
     )
-    fig2 = px.imshow(
-        pivot_vol,
-        color_continuous_scale="Blues",
-        aspect="auto",
-        title="Transaction Volume Heatmap",
-        labels={"x": "Hour of Day", "y": "Day of Week", "color": "Count"},
-        height=380,
+    fig.update_layout(
+        transition={"duration": 0},
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
     )
-    fig2.update_layout(plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)")
-    st.plotly_chart(fig2, use_container_width=True)
+    return fig
 
 
 def _render_geo_tab(df: pd.DataFrame) -> None:
-    FOREIGN_PREFIXES = ("5.188.", "185.220.", "193.32.", "45.142.", "91.108.")
-    geo_mismatch = df[
-        df["ip_address"].str.startswith(FOREIGN_PREFIXES) | (df["bin_country"] != df["country"])
-    ].copy()
+    geo_mismatch = df[df["geo_mismatch"]]
 
     st.metric("Geo Mismatch Transactions", len(geo_mismatch))
 
     if not geo_mismatch.empty:
         by_country = (
-            geo_mismatch.groupby(["country", "bin_country"])
+            geo_mismatch.groupby(["country", "bin_country"], observed=True)
             .agg(count=("transaction_id", "count"), avg_risk=("risk_score", "mean"))
             .reset_index()
             .sort_values("count", ascending=False)
@@ -476,23 +645,14 @@ def _render_geo_tab(df: pd.DataFrame) -> None:
         by_country.columns = ["Transaction Country", "BIN Country", "Count", "Avg Risk Score"]
         st.dataframe(by_country, use_container_width=True)
 
-        fig = px.bar(
-            geo_mismatch.groupby("country").size().reset_index(name="count"),
-            x="country",
-            y="count",
-            color="count",
-            color_continuous_scale="Reds",
-            title="Geo Mismatch Count by Transaction Country",
-            height=320,
-        )
-        fig.update_layout(plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)")
-        st.plotly_chart(fig, use_container_width=True)
+        country_counts = geo_mismatch.groupby("country", observed=True).size().reset_index(name="count")
+        st.plotly_chart(_build_geo_country_fig(country_counts), use_container_width=True)
 
         st.markdown("**Sample Geo Mismatch Transactions**")
         sample = geo_mismatch.nlargest(20, "risk_score")[
             ["timestamp", "customer_email", "country", "bin_country", "ip_address", "risk_score", "status"]
-        ].copy()
-        sample["timestamp"] = sample["timestamp"].dt.strftime("%Y-%m-%d %H:%M")
+        ]
+        sample = sample.assign(timestamp=sample["timestamp"].dt.strftime("%Y-%m-%d %H:%M"))
         st.dataframe(sample.reset_index(drop=True), use_container_width=True)
     else:
         st.info("No geo mismatches found in current filter.")
@@ -500,78 +660,85 @@ def _render_geo_tab(df: pd.DataFrame) -> None:
 
 # ── Export Report ─────────────────────────────────────────────────────────────
 
-def render_export_section(df: pd.DataFrame) -> None:
-    st.subheader("📤 Export Fraud Report")
-
-    col1, col2 = st.columns(2)
+REPORT_COLUMNS = [
+    "card_bin", "ip_address", "card_last4", "risk_score", "is_decline",
+    "hour", "country", "bin_country", "geo_mismatch",
+]
+REPORT_QUERIES = {
+    "top_bins": """
+        SELECT
+            card_bin,
+            COUNT(*)                                                AS total,
+            AVG(risk_score)                                         AS avg_risk,
+            ROUND(AVG(CAST(is_decline AS INTEGER)) * 100, 1)       AS decline_rate
+        FROM base
+        GROUP BY card_bin
+        ORDER BY avg_risk DESC, card_bin
+        LIMIT 10
+    """,
+    "top_ips": """
+        SELECT
+            ip_address,
+            COUNT(DISTINCT card_last4)                              AS unique_cards,
+            COUNT(*)                                                AS total_txns,
+            AVG(risk_score)                                         AS avg_risk
+        FROM base
+        GROUP BY ip_address
+        ORDER BY unique_cards DESC, ip_address
+        LIMIT 10
+    """,
+    "hourly": """
+        SELECT
+            hour,
+            COUNT(*)                                                AS count,
+            AVG(risk_score)                                         AS avg_risk
+        FROM base
+        GROUP BY hour
+        ORDER BY hour
+    """,
+    "geo": """
+        SELECT
+            country,
+            bin_country,
+            COUNT(*)                                                AS count
+        FROM base
+        WHERE geo_mismatch
+        GROUP BY country, bin_country
+        ORDER BY country, bin_country
+    """,
+}
 
-    # Build summary report
-    def build_report(df: pd.DataFrame) -> dict:
-        top_bins = (
-            df.groupby("card_bin")
-            .agg(
-                total=("transaction_id", "count"),
-                avg_risk=("risk_score", "mean"),
-                decline_rate=(
-                    "status",
-                    lambda s: round(s.isin(["declined_fraud", "declined_insufficient_funds"]).mean() * 100, 1),
-                ),
-            )
-            .nlargest(10, "avg_risk")
-            .reset_index()
-            .to_dict("records")
-        )
 
-        top_ips = (
-            df.groupby("ip_address")
-            .agg(
-                unique_cards=("card_last4", "nunique"),
-                total_txns=("transaction_id", "count"),
-                avg_risk=("risk_score", "mean"),
-            )
-            .nlargest(10, "unique_cards")
-            .reset_index()
-            .to_dict("records")
-        )
+def build_report(df: pd.DataFrame) -> dict:
+    """Summary report for the current filter; every grouped section is aggregated in DuckDB."""
+    sections = run_queries(df[REPORT_COLUMNS], REPORT_QUERIES)
+    return {
+        "generated_at": pd.Timestamp.now().isoformat(),
+        "total_transactions": len(df),
+        "critical_count": int(df["is_critical"].sum()),
+        "fraud_rate_pct": round(df["is_fraud_outcome"].mean() * 100, 2),
+        "top_bins": sections["top_bins"].to_dict("records"),
+        "top_ips_card_testing": sections["top_ips"].to_dict("records"),
+        "hourly_patterns": sections["hourly"].to_dict("records"),
+        "geo_anomalies": sections["geo"].to_dict("records"),
+    }
 
-        hourly = (
-            df.groupby("hour")
-            .agg(count=("transaction_id", "count"), avg_risk=("risk_score", "mean"))
-            .reset_index()
-            .to_dict("records")
-        )
 
-        FOREIGN_PREFIXES = ("5.188.", "185.220.", "193.32.", "45.142.", "91.108.")
-        geo_mismatch = df[
-            df["ip_address"].str.startswith(FOREIGN_PREFIXES) | (df["bin_country"] != df["country"])
-        ]
-        geo_summary = (
-            geo_mismatch.groupby(["country", "bin_country"])
-            .size()
-            .reset_index(name="count")
-            .to_dict("records")
-        )
+def render_export_section(df: pd.DataFrame) -> None:
+    st.subheader("📤 Export Fraud Report")
 
-        return {
-            "generated_at": pd.Timestamp.now().isoformat(),
-            "total_transactions": len(df),
-            "critical_count": int((df["risk_level"] == "CRITICAL").sum()),
-            "fraud_rate_pct": round(
-                df["status"].isin(["declined_fraud", "chargeback"]).mean() * 100, 2
-            ),
-            "top_bins": top_bins,
-            "top_ips_card_testing": top_ips,
-            "hourly_patterns": hourly,
-            "geo_anomalies": geo_summary,
-        }
+    col1, col2 = st.columns(2)
 
     report_data = build_report(df)
 
     # JSON download
-    json_str = json.dumps(report_data, indent=2, default=str)
+    json_bytes = orjson.dumps(
+        report_data,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC,
+    )
     col1.download_button(
         "⬇️ Download fraud_pattern_report.json",
-        data=json_str.encode("utf-8"),
+        data=json_bytes,
         file_name="fraud_pattern_report.json",
         mime="application/json",
         use_container_width=True,
@@ -581,8 +748,8 @@ def render_export_section(df: pd.DataFrame) -> None:
     report_df = df.nlargest(100, "risk_score")[
         ["transaction_id", "timestamp", "customer_email", "amount", "currency",
          "country", "card_bin", "ip_address", "risk_score", "risk_level", "signals_triggered", "status"]
-    ].copy()
-    report_df["timestamp"] = report_df["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    ]
+    report_df = report_df.assign(timestamp=report_df["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S"))
     csv_buf = io.StringIO()
     report_df.to_csv(csv_buf, index=False)
     col2.download_button(
@@ -621,18 +788,20 @@ def main():
         )
         st.stop()
 
-    df = load_data()
+    df = load_data(os.path.getmtime(DATA_PATH))
     filtered = render_sidebar(df)
 
     if filtered.empty:
         st.warning("No transactions match the current filters.")
         st.stop()
 
+    panels = compute_panels(filtered[PANEL_COLUMNS])
+
     st.markdown("---")
     render_kpis(filtered)
 
     st.markdown("---")
-    render_time_series(filtered)
+    render_time_series(panels)
 
     st.markdown("---")
     render_risk_distribution(filtered)
@@ -641,7 +810,7 @@ def main():
     render_anomalies_table(filtered)
 
     st.markdown("---")
-    render_pattern_insights(filtered)
+    render_pattern_insights(filtered, panels)
 
     st.markdown("---")
     render_export_section(filtered)
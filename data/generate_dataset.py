@@ -6,16 +6,23 @@ Generate synthetic transaction dataset for Solaris Media fraud detection.
 import random
 import csv
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from functools import lru_cache
+from operator import itemgetter
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
 
 # Seed for reproducibility
 random.seed(42)
+# Separate stream for the bulk legit fill, drawn column-wise
+rng = np.random.default_rng(42)
 
 # ── Constants ────────────────────────────────────────────────────────────────
 
 START_DATE = datetime(2026, 1, 20)
 END_DATE = datetime(2026, 2, 19)
 TARGET_ROWS = 900
+WRITE_BUFFER_BYTES = 4 * 1024 * 1024
 
 MONTHLY_PLANS = ["Monthly Basic", "Monthly Standard", "Monthly Pro"]
 ANNUAL_PLANS  = ["Annual Basic", "Annual Premium", "Annual Premium Plus"]
@@ -45,27 +52,36 @@ BAD_BINS = ["999001", "999002", "999003", "999004"]  # >50% decline rate
 # Card-testing IPs (6 IPs that will be used with many cards)
 CARDTEST_IPS = [f"185.220.101.{x}" for x in [34, 47, 88, 112, 156, 200]]
 
-# Normal IP pools by country
-NORMAL_IPS = {
-    "BR": [f"187.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
-    "MX": [f"189.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
-    "CO": [f"190.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
-}
-
-# Foreign IPs for geo mismatch (Eastern Europe / known fraud regions)
-FOREIGN_IPS = [f"5.188.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(30)]
-
 STATUSES = ["approved", "declined_fraud", "declined_insufficient_funds", "chargeback"]
 STATUS_WEIGHTS = [0.85, 0.06, 0.08, 0.01]
 
 TIERS = ["monthly", "annual"]
 
+EMAIL_NAMES = ["user", "cliente", "member", "sub", "acct", "customer"]
+EMAIL_DOMAINS = ["gmail.com", "hotmail.com", "yahoo.com", "outlook.com", "protonmail.com"]
+
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
+@lru_cache(maxsize=1)
+def ip_pools() -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    (normal IPs by country, foreign IPs), drawn from `random` on first call rather
+    than at import. generate() calls this before anything else so the seeded
+    draws come out the same.
+    """
+    # Normal IP pools by country
+    normal_ips = {
+        "BR": [f"187.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
+        "MX": [f"189.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
+        "CO": [f"190.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(80)],
+    }
+    # Foreign IPs for geo mismatch (Eastern Europe / known fraud regions)
+    foreign_ips = [f"5.188.{random.randint(0,255)}.{random.randint(0,255)}" for _ in range(30)]
+    return normal_ips, foreign_ips
+
+
 def random_email(seed_int: int) -> str:
-    domains = ["gmail.com", "hotmail.com", "yahoo.com", "outlook.com", "protonmail.com"]
-    names = ["user", "cliente", "member", "sub", "acct", "customer"]
-    return f"{random.choice(names)}{seed_int}@{random.choice(domains)}"
+    return f"{random.choice(EMAIL_NAMES)}{seed_int}@{random.choice(EMAIL_DOMAINS)}"
 
 
 def random_last4() -> str:
@@ -144,6 +160,7 @@ def inject_card_testing(txn_id_start: int, rows: List[dict]) -> int:
 
 def inject_bad_bins(txn_id_start: int, rows: List[dict]) -> int:
     """4 bad BINs, each with 7-10 transactions, >50% decline rate."""
+    normal_ips, _ = ip_pools()
     txn_id = txn_id_start
     for bad_bin in BAD_BINS:
         count = random.randint(7, 10)
@@ -155,7 +172,7 @@ def inject_bad_bins(txn_id_start: int, rows: List[dict]) -> int:
                 ["approved", "declined_fraud", "declined_insufficient_funds"],
                 weights=[0.3, 0.4, 0.3],
             )[0]
-            ip = random.choice(NORMAL_IPS[country])
+            ip = random.choice(normal_ips[country])
             rows.append(make_transaction(
                 txn_id, ts, country, random.choice(TIERS), status, ip,
                 bad_bin, random_last4(), email,
@@ -166,11 +183,12 @@ def inject_bad_bins(txn_id_start: int, rows: List[dict]) -> int:
 
 def inject_rapid_upgrades(txn_id_start: int, rows: List[dict]) -> int:
     """15 customers: monthly → annual in <6h."""
+    normal_ips, _ = ip_pools()
     txn_id = txn_id_start
     for i in range(15):
         country = random.choice(["BR", "MX", "CO"])
         email = random_email(txn_id + 7000)
-        ip = random.choice(NORMAL_IPS[country])
+        ip = random.choice(normal_ips[country])
         card_bin = random.choice(GOOD_BINS)
         last4 = random_last4()
         base_ts = random_timestamp(START_DATE, END_DATE - timedelta(hours=6))
@@ -191,11 +209,12 @@ def inject_rapid_upgrades(txn_id_start: int, rows: List[dict]) -> int:
 
 def inject_repeated_failures(txn_id_start: int, rows: List[dict]) -> int:
     """8 cards: 3+ declines then approval."""
+    normal_ips, _ = ip_pools()
     txn_id = txn_id_start
     for i in range(8):
         country = random.choice(["BR", "MX", "CO"])
         email = random_email(txn_id + 6000)
-        ip = random.choice(NORMAL_IPS[country])
+        ip = random.choice(normal_ips[country])
         card_bin = random.choice(GOOD_BINS)
         last4 = random_last4()
         base_ts = random_timestamp(START_DATE, END_DATE - timedelta(hours=4))
@@ -220,12 +239,13 @@ def inject_repeated_failures(txn_id_start: int, rows: List[dict]) -> int:
 
 def inject_geo_mismatches(txn_id_start: int, rows: List[dict]) -> int:
     """25 transactions: BIN country ≠ IP country."""
+    _, foreign_ips = ip_pools()
     txn_id = txn_id_start
     countries = list(CURRENCIES.keys())
     for i in range(25):
         card_country = random.choice(countries)
         # IP from a different country (foreign)
-        ip = random.choice(FOREIGN_IPS)
+        ip = random.choice(foreign_ips)
         # BIN from card_country
         card_bin = random.choice(GOOD_BINS)
         email = random_email(txn_id + 8000)
@@ -246,13 +266,14 @@ def inject_geo_mismatches(txn_id_start: int, rows: List[dict]) -> int:
 
 def inject_chargeback_clusters(txn_id_start: int, rows: List[dict]) -> int:
     """Chargebacks concentrated on 2 bad BINs and 2 card-testing IPs."""
+    normal_ips, _ = ip_pools()
     txn_id = txn_id_start
     cluster_bins = BAD_BINS[:2]
     cluster_ips = CARDTEST_IPS[:2]
     for _ in range(15):
         country = random.choice(["BR", "MX", "CO"])
         card_bin = random.choice(cluster_bins)
-        ip = random.choice(cluster_ips + NORMAL_IPS[country][:5])
+        ip = random.choice(cluster_ips + normal_ips[country][:5])
         email = random_email(txn_id + 4000)
         ts = random_timestamp(START_DATE, END_DATE)
         rows.append(make_transaction(
@@ -291,11 +312,42 @@ def inject_concentrated_attacks(txn_id_start: int, rows: List[dict]) -> int:
     return txn_id
 
 
+# ── Legit traffic ────────────────────────────────────────────────────────────
+
+def generate_legit(txn_id_start: int, n: int) -> List[dict]:
+    """n legit transactions, every column drawn in one vectorized RNG call."""
+    normal_ips, _ = ip_pools()
+    countries = rng.choice(["BR", "MX", "CO"], size=n, p=[0.5, 0.3, 0.2]).tolist()
+    ip_idx = rng.integers(0, len(normal_ips["BR"]), size=n).tolist()
+    card_bins = rng.choice(GOOD_BINS, size=n).tolist()
+    last4s = rng.integers(1000, 10000, size=n).astype(str).tolist()
+    names = rng.choice(EMAIL_NAMES, size=n).tolist()
+    domains = rng.choice(EMAIL_DOMAINS, size=n).tolist()
+    total_seconds = int((END_DATE - START_DATE).total_seconds())
+    offsets = rng.integers(0, total_seconds + 1, size=n).tolist()
+    tiers = rng.choice(TIERS, size=n, p=[0.7, 0.3]).tolist()
+    statuses = rng.choice(STATUSES, size=n, p=STATUS_WEIGHTS).tolist()
+    plan_idx = rng.integers(0, len(MONTHLY_PLANS), size=n).tolist()
+
+    return [
+        make_transaction(
+            txn_id, START_DATE + timedelta(seconds=offset), country, tier, status,
+            normal_ips[country][ip], card_bin, last4, f"{name}{txn_id}@{domain}",
+            plan=(MONTHLY_PLANS if tier == "monthly" else ANNUAL_PLANS)[plan],
+        )
+        for txn_id, country, ip, card_bin, last4, name, domain, offset, tier, status, plan in zip(
+            range(txn_id_start, txn_id_start + n), countries, ip_idx, card_bins, last4s,
+            names, domains, offsets, tiers, statuses, plan_idx,
+        )
+    ]
+
+
 # ── Main generation ───────────────────────────────────────────────────────────
 
 def generate() -> List[dict]:
     rows = []
     txn_id = 1
+    ip_pools()  # first draws from the seeded stream, as when the pools were module-level
 
     # Inject fraud patterns first
     txn_id = inject_card_testing(txn_id, rows)      # ~42 rows
@@ -310,17 +362,7 @@ def generate() -> List[dict]:
 
     # Fill remainder with legit transactions
     legit_needed = max(TARGET_ROWS - fraud_count, 400)
-    for _ in range(legit_needed):
-        country = random.choices(["BR", "MX", "CO"], weights=[0.5, 0.3, 0.2])[0]
-        ip = random.choice(NORMAL_IPS[country])
-        card_bin = random.choice(GOOD_BINS)
-        last4 = random_last4()
-        email = random_email(txn_id)
-        ts = random_timestamp(START_DATE, END_DATE)
-        tier = random.choices(TIERS, weights=[0.7, 0.3])[0]
-        status = random.choices(STATUSES, weights=STATUS_WEIGHTS)[0]
-        rows.append(make_transaction(txn_id, ts, country, tier, status, ip, card_bin, last4, email))
-        txn_id += 1
+    rows.extend(generate_legit(txn_id, legit_needed))
 
     # Sort by timestamp
     rows.sort(key=lambda r: r["timestamp"])
@@ -330,10 +372,11 @@ def generate() -> List[dict]:
 def write_csv(rows: List[dict], path: str) -> None:
     if not rows:
         return
-    with open(path, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
+    fieldnames = tuple(rows[0])
+    with open(path, "w", newline="", buffering=WRITE_BUFFER_BYTES) as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        writer.writerows(map(itemgetter(*fieldnames), rows))
 
 
 if __name__ == "__main__":
@@ -16,9 +16,17 @@ Risk levels:
 """
 
 import json
-from datetime import datetime, timedelta
+from typing import Iterable, Optional
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; kernels then run as plain Python
+    def njit(*args, **kwargs):
+        return lambda fn: fn
 
 SCORE_IP_VELOCITY = 40
 SCORE_RAPID_UPGRADE = 30
@@ -33,79 +41,127 @@ BIN_DECLINE_THRESHOLD = 0.40       # 40%
 BIN_DECLINE_MIN_TXNS = 3
 REPEATED_FAILURE_THRESHOLD = 3     # declines before approval
 
-DECLINE_STATUSES = {"declined_fraud", "declined_insufficient_funds"}
+# Upper score bound (inclusive) of each level below CRITICAL
+RISK_LEVEL_BOUNDS = (20, 40, 65)
+RISK_LEVELS = np.array(["LOW", "MEDIUM", "HIGH", "CRITICAL"], dtype=object)
+
+DECLINE_STATUSES = frozenset({"declined_fraud", "declined_insufficient_funds"})
 
 # Countries with known high-fraud IP prefixes (simplified inference)
 FOREIGN_IP_PREFIXES = ("5.188.", "185.220.", "193.32.", "45.142.", "91.108.")
 
-
-def _parse_timestamps(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    return df
+# Signal names in bit order; bit i of a row's mask is set when SIGNAL_NAMES[i] fired
+SIGNAL_NAMES = (
+    "ip_velocity",
+    "rapid_tier_upgrade",
+    "bin_decline_rate",
+    "geo_mismatch",
+    "repeated_failures",
+)
+# signals_triggered JSON for every possible mask, so rows only need a lookup
+_SIGNALS_JSON = np.array(
+    [
+        json.dumps([name for bit, name in enumerate(SIGNAL_NAMES) if mask >> bit & 1])
+        for mask in range(1 << len(SIGNAL_NAMES))
+    ],
+    dtype=object,
+)
+
+
+@njit(cache=True)
+def _ip_velocity_kernel(ip_ids, ts_ns, card_codes, n_cards, window_ns, threshold):
+    """
+    Rows sorted by (ip, time). A two-pointer window keeps per-card counts of the
+    rows inside [ts-window, ts] for the current IP plus the number of distinct
+    cards among them; rows of the previous IP drain out as `left` catches up.
+    """
+    n = len(ip_ids)
+    flagged = np.zeros(n, dtype=np.bool_)
+    in_window = np.zeros(n_cards, dtype=np.int64)
+    distinct = 0
+    left = 0
+    for i in range(n):
+        code = card_codes[i]
+        if in_window[code] == 0:
+            distinct += 1
+        in_window[code] += 1
+        while ip_ids[left] != ip_ids[i] or ts_ns[left] < ts_ns[i] - window_ns:
+            expired = card_codes[left]
+            in_window[expired] -= 1
+            if in_window[expired] == 0:
+                distinct -= 1
+            left += 1
+        flagged[i] = distinct > threshold
+    return flagged
 
 
 def _ip_velocity_signal(df: pd.DataFrame) -> pd.Series:
     """
     Flag transactions where the source IP had >3 unique cards within 24h of this txn.
     Returns a boolean Series.
-    """
-    df = df.sort_values("timestamp").reset_index(drop=True)
-    flagged = pd.Series(False, index=df.index)
-
-    # Build lookup: for each row, count unique cards from same IP in [ts-24h, ts]
-    # Efficient: group by IP then use a rolling window approach
-    for ip, group in df.groupby("ip_address"):
-        group = group.sort_values("timestamp")
-        idx_list = group.index.tolist()
-        ts_list = group["timestamp"].tolist()
-        card_list = (group["card_bin"].astype(str) + "-" + group["card_last4"].astype(str)).tolist()
-
-        for i, (idx, ts, _card) in enumerate(zip(idx_list, ts_list, card_list)):
-            window_start = ts - timedelta(hours=IP_VELOCITY_WINDOW_HOURS)
-            unique_cards = set()
-            for j in range(i + 1):
-                if ts_list[j] >= window_start:
-                    unique_cards.add(card_list[j])
-            if len(unique_cards) > IP_VELOCITY_THRESHOLD:
-                flagged[idx] = True
 
-    return flagged
+    Expects df in time order; the sliding-window scan is compiled by numba when it
+    is installed.
+    """
+    ip_ids, _ = pd.factorize(df["ip_address"])
+    # Stable sort of time-ordered rows by IP gives (ip, time) order
+    order = np.argsort(ip_ids, kind="stable")
+    card_codes = df["_card_key"].to_numpy(dtype=np.int64)
+    ts_ns = df["timestamp"].to_numpy().astype("datetime64[ns]").view("i8")
+
+    flagged = np.empty(len(df), dtype=bool)
+    flagged[order] = _ip_velocity_kernel(
+        ip_ids[order].astype(np.int64), ts_ns[order], card_codes[order],
+        card_codes.max() + 1 if len(card_codes) else 0,
+        IP_VELOCITY_WINDOW_HOURS * 3600 * 10**9, IP_VELOCITY_THRESHOLD,
+    )
+    return pd.Series(flagged, index=df.index)
 
 
 def _rapid_upgrade_signal(df: pd.DataFrame) -> pd.Series:
     """
     Flag annual transactions where the same email had a monthly txn in the past 24h.
     Also flag the preceding monthly txn.
+
+    Two as-of joins per email replace the per-annual-row scan: backward from each
+    annual txn finds a qualifying monthly one, forward from each monthly txn finds
+    the annual upgrade that follows it.
     """
-    df = df.sort_values("timestamp").reset_index(drop=True)
-    flagged = pd.Series(False, index=df.index)
+    flagged = np.zeros(len(df), dtype=bool)
 
-    annual = df[df["subscription_tier"] == "annual"]
-    monthly = df[df["subscription_tier"] == "monthly"]
+    cols = ["timestamp", "customer_email"]
+    rows = df[cols].assign(_row=np.arange(len(df)))
+    annual = rows[df["subscription_tier"] == "annual"]
+    monthly = rows[df["subscription_tier"] == "monthly"]
+    window = pd.Timedelta(hours=RAPID_UPGRADE_WINDOW_HOURS)
 
-    for _, ann_row in annual.iterrows():
-        window_start = ann_row["timestamp"] - timedelta(hours=RAPID_UPGRADE_WINDOW_HOURS)
-        prev_monthly = monthly[
-            (monthly["customer_email"] == ann_row["customer_email"])
-            & (monthly["timestamp"] >= window_start)
-            & (monthly["timestamp"] < ann_row["timestamp"])
-        ]
-        if not prev_monthly.empty:
-            flagged[ann_row.name] = True
-            flagged[prev_monthly.index] = True
+    def _asof(left: pd.DataFrame, right: pd.DataFrame, direction: str) -> np.ndarray:
+        matched = pd.merge_asof(
+            left, right, on="timestamp", by="customer_email", direction=direction,
+            tolerance=window, allow_exact_matches=False, suffixes=("", "_match"),
+        )
+        return matched.loc[matched["_row_match"].notna(), "_row"].to_numpy()
 
-    return flagged
+    flagged[_asof(annual, monthly, "backward")] = True
+    flagged[_asof(monthly, annual, "forward")] = True
+
+    return pd.Series(flagged, index=df.index)
 
 
-def _bin_decline_signal(df: pd.DataFrame) -> pd.Series:
+def _bin_decline_signal(
+    df: pd.DataFrame, decline_mask: np.ndarray, bad_bins: Optional[Iterable] = None
+) -> pd.Series:
     """
     Flag all transactions where the BIN has >40% decline rate (min 3 txns).
+    Pass bad_bins when they are already known (e.g. from DuckDB) to skip the groupby.
     """
-    decline_mask = df["status"].isin(DECLINE_STATUSES)
-    bin_stats = df.groupby("card_bin").agg(
-        total=("transaction_id", "count"),
-        declines=("status", lambda s: s.isin(DECLINE_STATUSES).sum()),
+    if bad_bins is not None:
+        return df["card_bin"].isin(bad_bins)
+
+    # Boolean mask summed per BIN stays on the Cython groupby path (no per-group lambda)
+    bin_stats = pd.Series(decline_mask, index=df.index).groupby(df["card_bin"], observed=True).agg(
+        total="size",
+        declines="sum",
     )
     bad_bins = bin_stats[
         (bin_stats["total"] >= BIN_DECLINE_MIN_TXNS)
@@ -126,60 +182,64 @@ def _geo_mismatch_signal(df: pd.DataFrame) -> pd.Series:
     return ip_is_foreign | bin_country_mismatch
 
 
-def _repeated_failures_signal(df: pd.DataFrame) -> pd.Series:
+def _repeated_failures_signal(
+    df: pd.DataFrame, decline_mask: np.ndarray, approved_mask: np.ndarray
+) -> pd.Series:
     """
     Flag the approval (and preceding declines) when a card had 3+ declines before approval.
+
+    Rows are ordered by (card, time) and cut into runs that close on each approval;
+    a run is flagged when it ends in an approval and holds enough declines.
     """
-    df = df.sort_values("timestamp").reset_index(drop=True)
-    flagged = pd.Series(False, index=df.index)
-
-    card_key = df["card_bin"].astype(str) + "-" + df["card_last4"].astype(str)
-    df = df.copy()
-    df["_card_key"] = card_key
-
-    for card, group in df.groupby("_card_key"):
-        group = group.sort_values("timestamp")
-        consecutive_declines = 0
-        decline_indices = []
-        for _, row in group.iterrows():
-            if row["status"] in DECLINE_STATUSES:
-                consecutive_declines += 1
-                decline_indices.append(row.name)
-            elif row["status"] == "approved":
-                if consecutive_declines >= REPEATED_FAILURE_THRESHOLD:
-                    flagged[row.name] = True
-                    for idx in decline_indices:
-                        flagged[idx] = True
-                consecutive_declines = 0
-                decline_indices = []
+    flagged = np.zeros(len(df), dtype=bool)
 
-    return flagged
+    card_codes = df["_card_key"].to_numpy()
+    order = np.lexsort((np.arange(len(df)), card_codes))
+    cards = card_codes[order]
+    is_decline = decline_mask[order]
+    is_approved = approved_mask[order]
 
+    # A new run starts at each card boundary and right after each approval
+    run_start = np.ones(len(order), dtype=bool)
+    run_start[1:] = (cards[1:] != cards[:-1]) | is_approved[:-1]
+    run_id = np.cumsum(run_start) - 1
 
-def _risk_level(score: int) -> str:
-    if score <= 20:
-        return "LOW"
-    elif score <= 40:
-        return "MEDIUM"
-    elif score <= 65:
-        return "HIGH"
-    else:
-        return "CRITICAL"
+    run_declines = np.bincount(run_id, weights=is_decline)
+    run_approved = np.bincount(run_id, weights=is_approved) > 0
+    run_flagged = run_approved & (run_declines >= REPEATED_FAILURE_THRESHOLD)
 
+    flagged[order] = run_flagged[run_id] & (is_decline | is_approved)
+    return pd.Series(flagged, index=df.index)
 
-def score_transactions(df: pd.DataFrame) -> pd.DataFrame:
+
+def score_transactions(df: pd.DataFrame, bad_bins: Optional[Iterable] = None) -> pd.DataFrame:
     """
     Enrich a transactions DataFrame with risk_score, risk_level, signals_triggered.
-    Returns enriched copy.
+    bad_bins, if given, are the BINs over the decline-rate threshold.
+    Returns an enriched copy in timestamp order, keeping the original index labels.
+
+    This is the scorer the pipeline runs. score_transactions_sql is a checked SQL
+    alternative; `python pipeline/risk_scoring.py` verifies the two agree.
     """
-    df = _parse_timestamps(df)
+    if not is_datetime64_any_dtype(df["timestamp"]):
+        df = df.assign(timestamp=pd.to_datetime(df["timestamp"]))
+    # Sorted once here; the per-IP, per-email and per-card signals all walk time order
+    df = df.sort_values("timestamp", kind="mergesort")
+
+    # Integer card id (BIN + last4), shared by the per-card and per-IP signals
+    card_groups = df.groupby(["card_bin", "card_last4"], sort=False, observed=True, dropna=False)
+    df = df.assign(_card_key=card_groups.ngroup().to_numpy())
+
+    # Status masks shared by the BIN and per-card signals
+    decline_mask = df["status"].isin(DECLINE_STATUSES).to_numpy()
+    approved_mask = (df["status"] == "approved").to_numpy()
 
     # Compute individual signals
     sig_ip_velocity = _ip_velocity_signal(df)
     sig_rapid_upgrade = _rapid_upgrade_signal(df)
-    sig_bin_decline = _bin_decline_signal(df)
+    sig_bin_decline = _bin_decline_signal(df, decline_mask, bad_bins)
     sig_geo_mismatch = _geo_mismatch_signal(df)
-    sig_repeated_failures = _repeated_failures_signal(df)
+    sig_repeated_failures = _repeated_failures_signal(df, decline_mask, approved_mask)
 
     # Aggregate scores
     scores = (
@@ -190,24 +250,146 @@ def score_transactions(df: pd.DataFrame) -> pd.DataFrame:
         + sig_repeated_failures.astype(int) * SCORE_REPEATED_FAILURES
     )
 
-    # Build signals_triggered JSON list per row
-    def build_signals(row_idx: int) -> str:
-        signals = []
-        if sig_ip_velocity.iloc[row_idx]:
-            signals.append("ip_velocity")
-        if sig_rapid_upgrade.iloc[row_idx]:
-            signals.append("rapid_tier_upgrade")
-        if sig_bin_decline.iloc[row_idx]:
-            signals.append("bin_decline_rate")
-        if sig_geo_mismatch.iloc[row_idx]:
-            signals.append("geo_mismatch")
-        if sig_repeated_failures.iloc[row_idx]:
-            signals.append("repeated_failures")
-        return json.dumps(signals)
-
-    result = df.copy()
+    # Pack the signals into a bitmask per row and look up the JSON list
+    signal_bits = np.zeros(len(df), dtype=np.uint8)
+    for bit, sig in enumerate(
+        (sig_ip_velocity, sig_rapid_upgrade, sig_bin_decline, sig_geo_mismatch, sig_repeated_failures)
+    ):
+        signal_bits |= sig.to_numpy(dtype=np.uint8) << bit
+
+    result = df.drop(columns="_card_key")
     result["risk_score"] = scores.values
-    result["risk_level"] = scores.map(_risk_level).values
-    result["signals_triggered"] = [build_signals(i) for i in range(len(df))]
+    result["risk_level"] = RISK_LEVELS[np.searchsorted(RISK_LEVEL_BOUNDS, scores.to_numpy())]
+    result["signals_triggered"] = _SIGNALS_JSON[signal_bits]
 
     return result
+
+
+def score_transactions_sql(conn, table: str = "txns", bad_bins: Optional[Iterable] = None) -> pd.DataFrame:
+    """
+    DuckDB equivalent of score_transactions, run against `table` on conn, for
+    callers that hold the data in DuckDB. Slower than the pandas path: the 24h
+    COUNT(DISTINCT) window over each IP dominates.
+    bad_bins, if given, replace the per-BIN decline-rate windows with a lookup.
+    Value lists (statuses, bad BINs) are bound as query parameters, never pasted in.
+    Each signal is a window over the partition it depends on (IP, email, BIN, card),
+    so the whole enrichment is one vectorized query. Rows keep their input order.
+    """
+    is_foreign_ip = " OR ".join(f"starts_with(ip_address, '{p}')" for p in FOREIGN_IP_PREFIXES)
+    signal_json = ", ".join(
+        f"""CASE WHEN {name} THEN '"{name}"' END""" for name in SIGNAL_NAMES
+    )
+    params = {"decline_statuses": sorted(DECLINE_STATUSES)}
+    if bad_bins is None:
+        bin_decline = f"""COUNT(*) OVER (PARTITION BY card_bin) >= {BIN_DECLINE_MIN_TXNS}
+                    AND CAST(SUM(_is_decline::INT) OVER (PARTITION BY card_bin) AS DOUBLE)
+                        / COUNT(*) OVER (PARTITION BY card_bin) > {BIN_DECLINE_THRESHOLD}"""
+    else:
+        params["bad_bins"] = list(bad_bins)
+        bin_decline = "card_bin = ANY($bad_bins)"
+    level_cases = " ".join(
+        f"WHEN risk_score <= {bound} THEN '{level}'"
+        for bound, level in zip(RISK_LEVEL_BOUNDS, RISK_LEVELS)
+    )
+
+    return conn.execute(f"""
+        WITH base AS (
+            SELECT
+                *,
+                ROW_NUMBER() OVER ()                                    AS _row,
+                card_bin || '-' || card_last4                           AS _card_key,
+                status = ANY($decline_statuses)                         AS _is_decline,
+                status = 'approved'                                     AS _is_approved
+            FROM {table}
+        ),
+        windowed AS (
+            SELECT
+                *,
+                COUNT(DISTINCT _card_key) OVER (
+                    PARTITION BY ip_address ORDER BY timestamp
+                    RANGE BETWEEN INTERVAL {IP_VELOCITY_WINDOW_HOURS} HOURS PRECEDING AND CURRENT ROW
+                ) > {IP_VELOCITY_THRESHOLD}                             AS ip_velocity,
+                CASE subscription_tier
+                    WHEN 'annual' THEN COUNT(*) FILTER (WHERE subscription_tier = 'monthly') OVER (
+                        PARTITION BY customer_email ORDER BY timestamp
+                        RANGE BETWEEN INTERVAL {RAPID_UPGRADE_WINDOW_HOURS} HOURS PRECEDING AND CURRENT ROW
+                        EXCLUDE GROUP
+                    ) > 0
+                    WHEN 'monthly' THEN COUNT(*) FILTER (WHERE subscription_tier = 'annual') OVER (
+                        PARTITION BY customer_email ORDER BY timestamp
+                        RANGE BETWEEN CURRENT ROW AND INTERVAL {RAPID_UPGRADE_WINDOW_HOURS} HOURS FOLLOWING
+                        EXCLUDE GROUP
+                    ) > 0
+                    ELSE FALSE
+                END                                                     AS rapid_tier_upgrade,
+                {bin_decline}
+                                                                        AS bin_decline_rate,
+                ({is_foreign_ip})
+                    OR bin_country IS DISTINCT FROM country             AS geo_mismatch,
+                -- Failure runs on a card close at each approval
+                COALESCE(SUM(_is_approved::INT) OVER (
+                    PARTITION BY _card_key ORDER BY timestamp, _row
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0)                                                   AS _run_id
+            FROM base
+        ),
+        scored AS (
+            SELECT
+                *,
+                (_is_decline OR _is_approved)
+                    AND BOOL_OR(_is_approved) OVER (PARTITION BY _card_key, _run_id)
+                    AND SUM(_is_decline::INT) OVER (PARTITION BY _card_key, _run_id)
+                        >= {REPEATED_FAILURE_THRESHOLD}                 AS repeated_failures
+            FROM windowed
+        ),
+        totals AS (
+            SELECT
+                *,
+                ip_velocity::INT * {SCORE_IP_VELOCITY}
+                    + rapid_tier_upgrade::INT * {SCORE_RAPID_UPGRADE}
+                    + bin_decline_rate::INT * {SCORE_BIN_DECLINE}
+                    + geo_mismatch::INT * {SCORE_GEO_MISMATCH}
+                    + repeated_failures::INT * {SCORE_REPEATED_FAILURES} AS risk_score
+            FROM scored
+        )
+        SELECT
+            * EXCLUDE (
+                _row, _card_key, _is_decline, _is_approved, _run_id, risk_score,
+                {", ".join(SIGNAL_NAMES)}
+            ),
+            risk_score,
+            CASE {level_cases} ELSE '{RISK_LEVELS[-1]}' END             AS risk_level,
+            '[' || concat_ws(', ', {signal_json}) || ']'                AS signals_triggered
+        FROM totals
+        ORDER BY _row
+    """, params).df()
+
+
+def check_sql_parity(conn, df: pd.DataFrame, table: str = "txns") -> int:
+    """
+    Score df with both implementations (df must be registered as `table` on conn)
+    and return the number of rows whose score, level or signals differ.
+    """
+    expected = score_transactions(df).sort_index()
+    actual = score_transactions_sql(conn, table)
+    mismatched = np.zeros(len(df), dtype=bool)
+    for col in ("risk_score", "risk_level", "signals_triggered"):
+        mismatched |= expected[col].astype(str).to_numpy() != actual[col].astype(str).to_numpy()
+    return int(mismatched.sum())
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    import duckdb
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from pipeline.run_pipeline import INPUT_PATH, load_with_duckdb
+
+    with duckdb.connect() as conn:
+        txns = load_with_duckdb(conn, INPUT_PATH)
+        conn.register("txns", txns)
+        diffs = check_sql_parity(conn, txns)
+    print(f"SQL vs pandas scoring: {diffs} of {len(txns)} rows differ")
+    sys.exit(1 if diffs else 0)
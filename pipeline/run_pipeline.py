@@ -4,7 +4,7 @@ Pipeline entry point: reads transactions.csv → enriches → saves enriched_tra
 DuckDB is used to:
   - Read the CSV efficiently with read_csv_auto
   - Pre-compute BIN decline rates and IP velocity counts via SQL
-  - Write the enriched output back to CSV
+  - Write the enriched output back to CSV, plus a Parquet copy for the dashboard
 """
 
 import os
@@ -15,28 +15,41 @@ import pandas as pd
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pipeline.risk_scoring import score_transactions
+from pipeline.risk_scoring import BIN_DECLINE_THRESHOLD, score_transactions
+from pipeline.schema import parquet_select
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
 INPUT_PATH = os.path.join(DATA_DIR, "transactions.csv")
 OUTPUT_PATH = os.path.join(DATA_DIR, "enriched_transactions.csv")
+PARQUET_OUTPUT_PATH = os.path.splitext(OUTPUT_PATH)[0] + ".parquet"
 
+# Pinned so timestamps arrive parsed and card identifiers stay strings
+CSV_DTYPES = {"timestamp": "TIMESTAMP", "card_bin": "VARCHAR", "card_last4": "VARCHAR"}
+# Low-cardinality columns held as categoricals: isin / == / groupby run on integer codes
+CATEGORICAL_COLUMNS = ("status", "subscription_tier", "currency", "card_bin")
 
-def load_with_duckdb(path: str) -> pd.DataFrame:
-    """Read CSV with DuckDB and return a pandas DataFrame."""
-    conn = duckdb.connect()
-    df = conn.execute(f"SELECT * FROM read_csv_auto('{path}')").df()
-    conn.close()
-    return df
+
+def load_with_duckdb(conn: duckdb.DuckDBPyConnection, path: str) -> pd.DataFrame:
+    """
+    Read CSV with DuckDB and return a pandas DataFrame with timestamps parsed and
+    low-cardinality columns as categoricals.
+    """
+    df = conn.read_csv(path, dtype=CSV_DTYPES).df()
+    # country and bin_country are compared with each other, so they share one dtype
+    countries = pd.CategoricalDtype(sorted(set(df["country"]) | set(df["bin_country"])))
+    return df.astype({
+        **{col: "category" for col in CATEGORICAL_COLUMNS},
+        "country": countries,
+        "bin_country": countries,
+    })
 
 
-def compute_bin_stats(df: pd.DataFrame) -> pd.DataFrame:
+def compute_bin_stats(conn: duckdb.DuckDBPyConnection) -> pd.DataFrame:
     """
     Use DuckDB SQL to compute per-BIN decline rates and risk aggregates.
+    Expects the raw transactions registered as `txns` on conn.
     Returns a summary DataFrame for reporting.
     """
-    conn = duckdb.connect()
-    conn.register("txns", df)
     bin_stats = conn.execute("""
         SELECT
             card_bin,
@@ -60,16 +73,14 @@ def compute_bin_stats(df: pd.DataFrame) -> pd.DataFrame:
         HAVING COUNT(*) >= 3
         ORDER BY decline_rate_pct DESC
     """).df()
-    conn.close()
     return bin_stats
 
 
-def compute_ip_velocity(df: pd.DataFrame) -> pd.DataFrame:
+def compute_ip_velocity(conn: duckdb.DuckDBPyConnection) -> pd.DataFrame:
     """
     Use DuckDB SQL to find IPs with high card diversity (card-testing indicator).
+    Expects the raw transactions registered as `txns` on conn.
     """
-    conn = duckdb.connect()
-    conn.register("txns", df)
     ip_stats = conn.execute("""
         SELECT
             ip_address,
@@ -88,65 +99,74 @@ def compute_ip_velocity(df: pd.DataFrame) -> pd.DataFrame:
         ORDER BY unique_cards DESC
         LIMIT 20
     """).df()
-    conn.close()
     return ip_stats
 
 
-def save_enriched_duckdb(enriched: pd.DataFrame, path: str) -> None:
-    """Write enriched DataFrame to CSV via DuckDB COPY."""
-    conn = duckdb.connect()
-    conn.register("enriched", enriched)
+def save_enriched_duckdb(conn: duckdb.DuckDBPyConnection, path: str, parquet_path: str) -> None:
+    """
+    Write the DataFrame registered as `enriched` on conn to CSV via DuckDB COPY,
+    then to Parquet straight from memory. The Parquet copy is written second so it
+    is newer than the CSV and the dashboard loads it without re-converting. Column
+    types follow pipeline.schema, shared with the dashboard's own conversion.
+    """
     conn.execute(f"COPY enriched TO '{path}' (HEADER, DELIMITER ',')")
-    conn.close()
+    conn.execute(f"""
+        COPY ({parquet_select("enriched")})
+        TO '{parquet_path}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    """)
 
 
 def run():
-    print(f"[DuckDB] Reading {INPUT_PATH} ...")
-    df = load_with_duckdb(INPUT_PATH)
-    print(f"  Loaded {len(df)} transactions")
-
-    print("[DuckDB] Pre-computing BIN stats ...")
-    bin_stats = compute_bin_stats(df)
-    print(f"  {len(bin_stats)} BINs analysed")
-    bad_bins = bin_stats[bin_stats["decline_rate_pct"] > 40]["card_bin"].tolist()
-    print(f"  Bad BINs (>40% decline): {bad_bins}")
-
-    print("[DuckDB] Pre-computing IP velocity ...")
-    ip_stats = compute_ip_velocity(df)
-    suspicious_ips = ip_stats[ip_stats["unique_cards"] > 3]["ip_address"].tolist()
-    print(f"  Suspicious IPs (>3 unique cards): {len(suspicious_ips)} found")
-
-    print("[pandas] Scoring transactions ...")
-    enriched = score_transactions(df)
-
-    print(f"[DuckDB] Writing enriched dataset → {OUTPUT_PATH}")
-    save_enriched_duckdb(enriched, OUTPUT_PATH)
-
-    # Summary via DuckDB query on enriched data
-    conn = duckdb.connect()
-    conn.register("enriched", enriched)
-    summary = conn.execute("""
-        SELECT
-            risk_level,
-            COUNT(*)                    AS count,
-            ROUND(AVG(risk_score), 1)   AS avg_score,
-            COUNT(*) * 100.0 / SUM(COUNT(*)) OVER () AS pct
-        FROM enriched
-        GROUP BY risk_level
-        ORDER BY avg_score DESC
-    """).df()
-    conn.close()
-
-    print("\nRisk level distribution (via DuckDB):")
-    for _, row in summary.iterrows():
-        print(f"  {row['risk_level']:10s}: {int(row['count']):4d}  ({row['pct']:.1f}%)")
-
-    critical = enriched[enriched["risk_level"] == "CRITICAL"]
-    print(f"\nCRITICAL transactions ({len(critical)}):")
-    for _, row in critical.head(5).iterrows():
-        print(f"  {row['transaction_id']} | {row['customer_email']} | score={row['risk_score']} | signals={row['signals_triggered']}")
-
-    print(f"\nDone! Enriched dataset saved to {OUTPUT_PATH}")
+    # One connection for the whole run; frames are registered once and reused
+    with duckdb.connect() as conn:
+        print(f"[DuckDB] Reading {INPUT_PATH} ...")
+        df = load_with_duckdb(conn, INPUT_PATH)
+        conn.register("txns", df)
+        print(f"  Loaded {len(df)} transactions")
+
+        print("[DuckDB] Pre-computing BIN stats ...")
+        bin_stats = compute_bin_stats(conn)
+        print(f"  {len(bin_stats)} BINs analysed")
+        # Unrounded ratio, so the cut matches the scoring signal exactly
+        bad_bins = bin_stats.loc[
+            bin_stats["total_declines"] / bin_stats["total_txns"] > BIN_DECLINE_THRESHOLD, "card_bin"
+        ].tolist()
+        print(f"  Bad BINs (>40% decline): {bad_bins}")
+
+        print("[DuckDB] Pre-computing IP velocity ...")
+        ip_stats = compute_ip_velocity(conn)
+        suspicious_ips = ip_stats[ip_stats["unique_cards"] > 3]["ip_address"].tolist()
+        print(f"  Suspicious IPs (>3 unique cards): {len(suspicious_ips)} found")
+
+        print("[pandas] Scoring transactions ...")
+        enriched = score_transactions(df, bad_bins=bad_bins)
+        conn.register("enriched", enriched)
+
+        print(f"[DuckDB] Writing enriched dataset → {OUTPUT_PATH}")
+        save_enriched_duckdb(conn, OUTPUT_PATH, PARQUET_OUTPUT_PATH)
+
+        # Summary via DuckDB query on the in-memory enriched frame (no re-read from disk)
+        summary = conn.execute("""
+            SELECT
+                risk_level,
+                COUNT(*)                    AS count,
+                ROUND(AVG(risk_score), 1)   AS avg_score,
+                COUNT(*) * 100.0 / SUM(COUNT(*)) OVER () AS pct
+            FROM enriched
+            GROUP BY risk_level
+            ORDER BY avg_score DESC
+        """).df()
+
+        print("\nRisk level distribution (via DuckDB):")
+        for row in summary.itertuples(index=False):
+            print(f"  {row.risk_level:10s}: {int(row.count):4d}  ({row.pct:.1f}%)")
+
+        critical = enriched[enriched["risk_level"] == "CRITICAL"]
+        print(f"\nCRITICAL transactions ({len(critical)}):")
+        for row in critical.head(5).itertuples(index=False):
+            print(f"  {row.transaction_id} | {row.customer_email} | score={row.risk_score} | signals={row.signals_triggered}")
+
+        print(f"\nDone! Enriched dataset saved to {OUTPUT_PATH}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+"""
+Schema of the enriched dataset's Parquet copy (data/enriched_transactions.parquet).
+
+Two writers produce that file: the pipeline, straight from its scored frame, and the
+dashboard, when it re-converts an enriched CSV that is newer than the Parquet copy.
+Both select through parquet_select() so readers see the same column types either way.
+"""
+
+# Pinned Parquet types, by column; all other columns keep the type of their source.
+#   card_bin / card_last4 — numeric card identifiers. The pipeline holds them as
+#       strings (to keep them out of arithmetic), but consumers key and sort on them
+#       as integers, e.g. the report emits card_bin as a JSON number.
+#   risk_score — the SQL scorer sums INTEGER terms; widened to the 64-bit integer
+#       every CSV reader infers for the column.
+ENRICHED_PARQUET_TYPES = {
+    "card_bin": "BIGINT",
+    "card_last4": "BIGINT",
+    "risk_score": "BIGINT",
+}
+
+
+def parquet_select(source: str) -> str:
+    """DuckDB SELECT over `source` with the ENRICHED_PARQUET_TYPES casts applied."""
+    casts = ", ".join(
+        f"CAST({col} AS {sql_type}) AS {col}" for col, sql_type in ENRICHED_PARQUET_TYPES.items()
+    )
+    return f"SELECT * REPLACE ({casts}) FROM {source}"
@@ -1,46 +1,68 @@
 """
 Capture dashboard screenshots using Playwright headless Chromium.
 
-Strategy: scroll_into_view_if_needed() puts the heading at the top,
-then we scrollBy() extra pixels so the actual chart content is centered.
+Strategy: one page session, each section captured with locator.screenshot()
+on its own element — Playwright scrolls it into view and crops to its box,
+so there are no calibrated scroll offsets to drift when the layout changes.
 
 Usage: python screenshots/capture.py
 """
 
 import os
-from playwright.sync_api import sync_playwright, Page
+from playwright.sync_api import sync_playwright, Locator, Page
 
 BASE_URL = "http://localhost:8501"
 OUT_DIR = os.path.dirname(os.path.abspath(__file__))
 VIEWPORT = {"width": 1400, "height": 900}
 
-# Streamlit's inner scrollable container selector
+# Section selectors — the dashboard renders its sections flat in stMain
+PLOTLY_CHART = ".js-plotly-plot"
+HORIZONTAL_BLOCK = '[data-testid="stHorizontalBlock"]'
+DATAFRAME = '[data-testid="stDataFrame"]'
+VISIBLE_TABPANEL = '[role="tabpanel"]:not([hidden])'
+INFO_ALERT = '[data-testid="stAlert"]'
+
+
 def wait_for_streamlit(page: Page):
+    """Block until the script run has finished and the charts are drawn."""
     page.wait_for_selector('[data-testid="stApp"]', timeout=20000)
-    page.wait_for_timeout(7000)
+    page.wait_for_function(
+        "() => {"
+        "  var w = document.querySelector('[data-testid=\"stStatusWidget\"]');"
+        "  return !w || w.innerText.indexOf('Running') === -1;"
+        "}",
+        timeout=30000,
+    )
+    page.wait_for_function(
+        "() => document.querySelectorAll('.js-plotly-plot').length >= 3",
+        timeout=30000,
+    )
 
 
-def set_scroll(page: Page, px: int, wait: int = 1000):
-    """Directly set stMain.scrollTop — predictable, no zoom side-effects."""
+def wait_for_idle(page: Page):
+    """Resolve once the browser has painted and gone idle after a DOM change."""
     page.evaluate(
-        "(function(y) {"
-        "  var m = document.querySelector('[data-testid=\"stMain\"]')"
-        "       || document.querySelector('.main')"
-        "       || document.scrollingElement;"
-        "  if (m) m.scrollTop = y;"
-        "})(" + str(px) + ")"
+        "() => new Promise(function(r) {"
+        "  (window.requestIdleCallback || window.requestAnimationFrame)(function() { r(); });"
+        "})"
     )
-    page.wait_for_timeout(wait)
 
 
-def click_tab(page: Page, label: str, wait: int = 1500):
+def click_tab(page: Page, label: str, ready: str) -> Locator:
+    """
+    Select a tab and return its panel once it is the visible one and `ready`
+    (a selector for content the tab always renders) is visible inside it.
+    """
     page.locator(f'button[role="tab"]:has-text("{label}")').first.click()
-    page.wait_for_timeout(wait)
+    page.locator(f'button[role="tab"][aria-selected="true"]:has-text("{label}")').first.wait_for()
+    panel = page.locator(VISIBLE_TABPANEL).first
+    panel.wait_for(state="visible")
+    panel.locator(ready).first.wait_for(state="visible")
+    return panel
 
 
-def save(page: Page, name: str):
-    path = os.path.join(OUT_DIR, f"{name}.png")
-    page.screenshot(path=path, full_page=False)
+def save(locator: Locator, name: str):
+    locator.screenshot(path=os.path.join(OUT_DIR, f"{name}.png"))
     print(f"  ✓  {name}.png")
 
 
@@ -54,58 +76,40 @@ def run():
         wait_for_streamlit(page)
         print("Streamlit loaded — capturing...\n")
 
-        # Approximate stMain.scrollTop values for each section (calibrated):
-        #   0    → KPI cards
-        #   380  → Time series chart centered
-        #   820  → Risk Distribution (donut + bar)
-        #   1280 → Top 20 Anomalies table
-        #   1780 → Pattern Insights tabs
-
         # ── 01: KPI Cards ─────────────────────────────────────────────────────
-        set_scroll(page, 0, wait=800)
-        save(page, "01_overview_kpis")
+        kpis = page.locator(HORIZONTAL_BLOCK).filter(has=page.locator('[data-testid="stMetric"]'))
+        save(kpis.first, "01_overview_kpis")
 
         # ── 02: Time Series (stacked bars by risk level) ───────────────────────
-        set_scroll(page, 380, wait=1000)
-        save(page, "02_time_series_risk_colorcoded")
+        save(page.locator(PLOTLY_CHART).first, "02_time_series_risk_colorcoded")
 
         # ── 03: Risk Distribution (donut + stacked bar by country) ─────────────
-        set_scroll(page, 820, wait=1000)
-        save(page, "03_risk_distribution")
-
-        # ── 04: Top 20 Anomalies (CRITICAL rows highlighted) ───────────────────
-        # Scroll to 1280 in two steps: prime the dataframe render first,
-        # then settle at final position with a long wait for layout stabilization.
-        set_scroll(page, 900, wait=1500)
-        set_scroll(page, 1280, wait=3000)
-        save(page, "04_top_anomalies_critical_highlighted")
-
-        # ── 05: Pattern Insights → BINs tab ───────────────────────────────────
-        set_scroll(page, 1780, wait=800)
-        click_tab(page, "💳 BINs")
-        set_scroll(page, 1980, wait=1000)
-        save(page, "05_pattern_bins")
-
-        # ── 06: IPs tab (card testing map) ────────────────────────────────────
-        set_scroll(page, 1780, wait=600)
-        click_tab(page, "🌐 IPs")
-        set_scroll(page, 1980, wait=1000)
-        save(page, "06_pattern_ips_card_testing")
-
-        # ── 07: Horario heatmap ────────────────────────────────────────────────
-        set_scroll(page, 1780, wait=600)
-        click_tab(page, "🕐 Horario")
-        set_scroll(page, 1980, wait=1200)
-        save(page, "07_pattern_hourly_heatmap")
-
-        # ── 08: Geo mismatches ─────────────────────────────────────────────────
-        set_scroll(page, 1780, wait=600)
-        click_tab(page, "🗺️ Geo")
-        set_scroll(page, 1980, wait=1000)
-        save(page, "08_pattern_geo_mismatches")
+        risk = page.locator(HORIZONTAL_BLOCK).filter(has=page.locator(PLOTLY_CHART))
+        save(risk.first, "03_risk_distribution")
+
+        # ── 04: Top 20 Anomalies (risk_level badges) ──────────────────────────
+        # The grid draws to a canvas only once it is on screen, so bring it into
+        # view and let it paint before cropping.
+        anomalies = page.locator(DATAFRAME).first
+        anomalies.scroll_into_view_if_needed()
+        anomalies.locator("canvas").first.wait_for(state="visible")
+        wait_for_idle(page)
+        save(anomalies, "04_top_anomalies_critical_highlighted")
+
+        # ── 05–08: Pattern Insights tabs ──────────────────────────────────────
+        # Geo renders a chart only when there are mismatches, otherwise an info box
+        for label, name, ready in [
+            ("💳 BINs", "05_pattern_bins", PLOTLY_CHART),
+            ("🌐 IPs", "06_pattern_ips_card_testing", PLOTLY_CHART),
+            ("🕐 Horario", "07_pattern_hourly_heatmap", PLOTLY_CHART),
+            ("🗺️ Geo", "08_pattern_geo_mismatches", f"{PLOTLY_CHART}, {INFO_ALERT}"),
+        ]:
+            save(click_tab(page, label, ready), name)
 
         # ── 00: Full page ──────────────────────────────────────────────────────
-        set_scroll(page, 0, wait=800)
+        # stMain is the scroll container, so return it to the top first
+        page.locator("h1").first.scroll_into_view_if_needed()
+        wait_for_idle(page)
         page.screenshot(path=os.path.join(OUT_DIR, "00_full_page.png"), full_page=True)
         print(f"  ✓  00_full_page.png")
 